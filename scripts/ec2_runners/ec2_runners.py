@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
 import argparse
+import functools
 import os
-import yaml
-import boto3
-import requests
 import time
 import sys
 from pathlib import Path
@@ -53,6 +51,8 @@ def get_github_token():
 
 def get_runner_registration_token(github_repo, token):
     """Gets a registration token from the GitHub API."""
+    import requests
+
     url = (
         f"https://api.github.com/repos/{github_repo}/actions/runners/registration-token"
     )
@@ -70,6 +70,8 @@ def get_runner_registration_token(github_repo, token):
 
 def get_github_runners(repo, token):
     """Gets runners from the GitHub API."""
+    import requests
+
     url = f"https://api.github.com/repos/{repo}/actions/runners"
     headers = {
         "Authorization": f"token {token}",
@@ -85,6 +87,8 @@ def get_github_runners(repo, token):
 
 def remove_github_runner(repo, token, runner_id):
     """Removes a runner from GitHub."""
+    import requests
+
     url = f"https://api.github.com/repos/{repo}/actions/runners/{runner_id}"
     headers = {
         "Authorization": f"token {token}",
@@ -234,6 +238,14 @@ def create_security_group(ec2, repo, vpc_id):
     return security_group_id, f"Created security group: {security_group_id}"
 
 
+@functools.lru_cache(maxsize=8)
+def get_ec2_client(region):
+    """Get a cached EC2 client for the given region."""
+    import boto3
+
+    return boto3.client("ec2", region_name=region)
+
+
 def get_root_device_name(ec2, ami_id):
     """Get the root device name for an AMI."""
     ami_info = ec2.describe_images(ImageIds=[ami_id])
@@ -386,7 +398,7 @@ def deploy_runners(args):
                     f"User data script not found: {args.user_data}"
                 )
 
-        ec2 = boto3.client("ec2", region_name=region)
+        ec2 = get_ec2_client(region)
 
         # Create security group if not specified
         if not security_group_id:
@@ -595,7 +607,7 @@ def undeploy_runners(args):
                 action.note("No label filter - will find all instances")
             result.add_success("Configuration loaded")
 
-        ec2 = boto3.client("ec2", region_name=region)
+        ec2 = get_ec2_client(region)
 
         # Find instances to terminate
         with Action("Finding instances to terminate") as action:
@@ -765,7 +777,7 @@ def display_github_runners(github_runners):
         if RUNNER_NAME_PREFIX in runner.get("name", ""):
             ec2_runners.append(runner)
 
-    print(f"EC2 runners: {len(ec2_runners)}")
+    out = [f"EC2 runners: {len(ec2_runners)}"]
 
     for runner in ec2_runners:
         status = runner.get("status", "unknown")
@@ -776,17 +788,19 @@ def display_github_runners(github_runners):
         # Extract labels
         label_names = [label.get("name", "") for label in runner.get("labels", [])]
 
-        print(f"{status_icon} {runner['name']}")
-        print(
+        out.append(f"{status_icon} {runner['name']}")
+        out.append(
             f"   Status: {status}"
             + (" ⚡ Currently busy" if runner.get("busy") else "")
         )
-        print(f"   Labels: {', '.join(label_names)}")
+        out.append(f"   Labels: {', '.join(label_names)}")
+
+    sys.stdout.write("\n".join(out) + "\n")
 
 
 def display_ec2_instances(instances):
     """Display EC2 instances information."""
-    print(f"EC2 instances: {len(instances)}")
+    out = [f"EC2 instances: {len(instances)}"]
     for instance in instances:
         state = instance["State"]["Name"]
         state_icon = (
@@ -794,14 +808,15 @@ def display_ec2_instances(instances):
         )
 
         # Get tags
-        tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
-        name = tags.get("Name", "Unknown")
+        name = get_instance_tags(instance).get("Name", "Unknown")
 
-        print(f"{state_icon} {name} ({instance['InstanceId']})")
-        print(f"   State: {state}")
-        print(f"   Type: {instance['InstanceType']}")
+        out.append(f"{state_icon} {name} ({instance['InstanceId']})")
+        out.append(f"   State: {state}")
+        out.append(f"   Type: {instance['InstanceType']}")
         if instance.get("PublicIpAddress"):
-            print(f"   IP: {instance['PublicIpAddress']}")
+            out.append(f"   IP: {instance['PublicIpAddress']}")
+
+    sys.stdout.write("\n".join(out) + "\n")
 
 
 def list_runners(args):
@@ -826,7 +841,7 @@ def list_runners(args):
 
         with Action("Fetching EC2 instances") as action:
             # Check EC2 instances
-            ec2 = boto3.client("ec2", region_name=region)
+            ec2 = get_ec2_client(region)
 
             # Get instances for this repo
             filters = [
@@ -856,6 +871,7 @@ def load_config(config_path):
 
     # Replace environment variables in the content
     import re
+    import yaml
 
     def replace_env_var(match):
         var_name = match.group(1)
@@ -891,12 +907,19 @@ def load_config(config_path):
     return config
 
 
+def get_instance_tags(instance):
+    """Get instance tags as a dict, cached on the instance."""
+    tags = instance.get("_tagdict")
+    if tags is None:
+        tags = instance.setdefault(
+            "_tagdict", {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+        )
+    return tags
+
+
 def get_instance_name_from_tags(instance):
     """Extract instance name from tags."""
-    for tag in instance.get("Tags", []):
-        if tag["Key"] == "Name":
-            return tag["Value"]
-    return None
+    return get_instance_tags(instance).get("Name")
 
 
 def validate_networking_config(config):
@@ -4,10 +4,25 @@ import argparse
 import os
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN") or os.getenv("GH_TOKEN")
 GITHUB_REPO = "Altinity/ClickHouse"
 S3_BASE_URL = "https://s3.amazonaws.com/altinity-build-artifacts"
+REQUEST_TIMEOUT = (3, 10)  # (connect, read) seconds
+
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        respect_retry_after_header=True,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
 
 
 def get_run_details(run_url: str) -> dict:
@@ -22,7 +37,7 @@ def get_run_details(run_url: str) -> dict:
     }
 
     url = f"https://api.github.com/repos/{GITHUB_REPO}/actions/runs/{run_id}"
-    response = requests.get(url, headers=headers)
+    response = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
 
     if response.status_code != 200:
         raise Exception(
@@ -91,7 +106,7 @@ def main():
 
     print(workflow_config_url)
 
-    r = requests.get(workflow_config_url)
+    r = SESSION.get(workflow_config_url, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
     workflow_config = r.json()
 
@@ -99,7 +114,8 @@ def main():
         build_url = get_artifact_report_url(
             workflow_config, S3_BASE_URL, build, pr_number, branch_name, commit_sha
         )
-        n_builds = len(requests.get(build_url).json().get("build_urls", []))
+        r = SESSION.get(build_url, timeout=REQUEST_TIMEOUT)
+        n_builds = len(r.json().get("build_urls", []))
         print(f"Found {n_builds} builds for {build}: {build_url}")
 
 
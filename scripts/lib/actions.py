@@ -76,6 +76,8 @@ class Action:
         }
 
     def __enter__(self):
+        if not self.logger.isEnabledFor(self.level):
+            return self
         self.logger.log(
             msg=f"🍀 {self.name}",
             stacklevel=self.stacklevel + 1,
@@ -87,6 +89,9 @@ class Action:
     def note(self, message, stacklevel=None, level=None):
         """Add a note with optional level override."""
         log_level = level if level is not None else self.level
+        # Skip building the message for levels that are not logged
+        if not self.logger.isEnabledFor(log_level):
+            return
         self.logger.log(
             msg=f"   {message}",
             stacklevel=(self.stacklevel + 1) if stacklevel is None else stacklevel,
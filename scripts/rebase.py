@@ -6,10 +6,14 @@ import argparse
 import logging
 import subprocess
 import re
+import functools
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict
+from typing import BinaryIO, Iterator, List, Tuple, Optional, Dict, Set
 import shutil
-from fnmatch import fnmatch
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the parent directory to Python path to find the lib module
 script_dir = Path(__file__).absolute()
@@ -43,24 +47,249 @@ CI_DIRECTORIES = {
     "utils/tests-visualizer",
 }
 
+# Pathspecs selecting CI_DIRECTORIES, anchored at the repository root
+CI_PATHSPECS = [f":(top){directory}" for directory in sorted(CI_DIRECTORIES)]
+
+# Start of each file's patch in `git diff` output
+DIFF_HEADER_RE = re.compile(rb"^diff --git ", re.M)
+
+# Path in a `diff --git a/<path> b/<path>` header, which is C-quoted if it has
+# special characters. Without renames both sides name the same path
+DIFF_HEADER_PATH_RE = re.compile(
+    rb'diff --git (?:"a/((?:[^"\\]|\\.)*)" "b/\1"|a/(.*) b/\2)'
+)
+
+# Escapes in C-quoted paths, besides octal byte values
+QUOTED_PATH_ESCAPE_RE = re.compile(rb"\\(?:([0-7]{3})|(.))")
+QUOTED_PATH_ESCAPES = {
+    b"a": b"\a",
+    b"b": b"\b",
+    b"t": b"\t",
+    b"n": b"\n",
+    b"v": b"\v",
+    b"f": b"\f",
+    b"r": b"\r",
+    b'"': b'"',
+    b"\\": b"\\",
+}
+
+TAG_VERSION_RE = re.compile(r"v([\d.]+(?:-[a-z]+)?)")
+
+
+def confirm(prompt: str = "", assume_yes: bool = False) -> bool:
+    """Ask a yes/no question on stdin, or answer yes without asking."""
+    if assume_yes:
+        if prompt:
+            print(f"{prompt}y")
+        return True
+    return input(prompt).lower() == "y"
+
+
+def confirm_destructive(
+    prompt: str = "", assume_yes: bool = False, force: bool = False
+) -> bool:
+    """Ask a yes/no question about deleting or overwriting data.
+
+    Unlike confirm(), assume_yes answers no without asking, keeping the safe
+    default of non-interactive runs. Only force answers yes.
+    """
+    if force:
+        return confirm(prompt, assume_yes=True)
+    if assume_yes:
+        if prompt:
+            print(f"{prompt}n")
+        return False
+    return confirm(prompt)
+
+
+def _unquote_path(path: bytes) -> bytes:
+    """Decode the escapes in a path that git quoted."""
+    return QUOTED_PATH_ESCAPE_RE.sub(
+        lambda match: (
+            bytes([int(match.group(1), 8)])
+            if match.group(1)
+            else QUOTED_PATH_ESCAPES[match.group(2)]
+        ),
+        path,
+    )
+
+
+def split_patch_by_file(patch: bytes) -> Dict[str, List[bytes]]:
+    """Split `git diff` output into the patches of each file.
+
+    The files are named by the paths in the patch headers. A ValueError is
+    raised for a header without a path that can be read.
+    """
+    patches: Dict[str, List[bytes]] = {}
+    starts = [header.start() for header in DIFF_HEADER_RE.finditer(patch)]
+    for start, end in zip(starts, starts[1:] + [len(patch)]):
+        segment = patch[start:end]
+        header = segment.split(b"\n", 1)[0]
+        match = DIFF_HEADER_PATH_RE.fullmatch(header)
+        if not match:
+            raise ValueError(
+                f"Unexpected diff header: {header.decode(errors='replace')}"
+            )
+        if match.group(1) is not None:
+            path = _unquote_path(match.group(1))
+        else:
+            path = match.group(2)
+        # A type change is shown as two patches for the same file
+        file = path.decode(errors="surrogateescape")
+        patches.setdefault(file, []).append(segment)
+    return patches
+
+
+def _available_cpus() -> int:
+    """Number of CPUs this process may run on, honoring its affinity mask."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on macOS and Windows
+        return os.cpu_count() or 1
+
+
+# Use all available CPUs for the network and checkout work in clone, fetch
+# and pull, and for the per-patch checks
+GIT_JOBS = _available_cpus()
+PARALLEL_OPTIONS = [
+    "-c",
+    f"fetch.parallel={GIT_JOBS}",
+    "-c",
+    f"submodule.fetchJobs={GIT_JOBS}",
+    "-c",
+    f"checkout.workers={GIT_JOBS}",
+    "-c",
+    "index.threads=true",
+]
+
+# Skip index checksums, fsyncs and auto-gc while the patches are applied, see
+# GitCommandExecutor.fast_index(). Clone, fetch and checkout run without them,
+# so that the repository stays durable if they are interrupted
+FAST_INDEX_OPTIONS = [
+    "-c",
+    "index.skipHash=true",
+    "-c",
+    "core.fsync=none",
+    "-c",
+    "gc.auto=0",
+]
+
+# Read-only git queries that are cached until a command that may change the
+# repository runs, and other read-only commands that leave the cache alone
+CACHED_COMMANDS = {"rev-parse", "ls-tree", "show-ref", "for-each-ref"}
+READ_ONLY_COMMANDS = {"status", "diff", "log", "show", "format-patch", "ls-remote"}
+
+
 class GitCommandExecutor:
     """Base class for git command execution."""
 
+    # Shared by all executors, as they work on the same repository
+    _cache: Dict[tuple, Tuple[int, str, str]] = {}
+
     def __init__(self, work_dir: Path) -> None:
         self.work_dir = work_dir
+        self._fast_index = False
+
+    @contextmanager
+    def fast_index(self) -> Iterator[None]:
+        """Run the git commands inside the block with FAST_INDEX_OPTIONS."""
+        previous, self._fast_index = self._fast_index, True
+        try:
+            yield
+        finally:
+            self._fast_index = previous
+
+    @staticmethod
+    def _command_kind(cmd: List[str]) -> str:
+        """Classify a git command as "cached", "read" or "write"."""
+        # Skip leading -c options to get to the subcommand
+        i = 0
+        while cmd[i : i + 1] == ["-c"]:
+            i += 2
+        subcommand, args = (cmd[i], cmd[i + 1 :]) if i < len(cmd) else ("", [])
+        if subcommand in CACHED_COMMANDS:
+            return "cached"
+        if subcommand == "config" and args[:1] in (["--get"], ["--get-regexp"]):
+            return "cached"
+        if subcommand == "remote" and args[:1] == ["get-url"]:
+            return "cached"
+        if subcommand in READ_ONLY_COMMANDS:
+            return "read"
+        if subcommand == "apply" and "--check" in args:
+            return "read"
+        return "write"
 
     def execute_git_command(
-        self, cmd: List[str], cwd: Optional[str] = None
-    ) -> Tuple[int, str]:
-        """Execute a git command and return its result."""
-        with Action(f"git {' '.join(cmd)}", level=logging.DEBUG) as action:
+        self,
+        cmd: List[str],
+        cwd: Optional[str] = None,
+        text: bool = True,
+        capture_stdout: bool = True,
+        stdout_file: Optional[BinaryIO] = None,
+    ) -> Tuple[int, str, str]:
+        """Execute a git command and return its result.
+
+        With text=False the output is returned as bytes, and with
+        capture_stdout=False stdout is discarded instead of buffered.
+        If stdout_file is given, stdout is written straight to it.
+        Results of read-only queries are cached until a command that may
+        change the repository runs.
+        """
+        kind = self._command_kind(cmd)
+        key = (tuple(cmd), str(cwd or self.work_dir), text, capture_stdout)
+        if stdout_file is not None:
+            capture_stdout = False
+            if kind == "cached":
+                kind = "read"
+        if kind == "cached" and key in self._cache:
+            return self._cache[key]
+        if kind == "write":
+            self._cache.clear()
+
+        if self._fast_index:
+            cmd = FAST_INDEX_OPTIONS + cmd
+
+        # Only build the log messages when they would actually be emitted
+        debug = Action.logger.isEnabledFor(logging.DEBUG)
+        with (
+            Action(f"git {' '.join(cmd)}", level=logging.DEBUG)
+            if debug
+            else nullcontext()
+        ) as action:
             result = subprocess.run(
-                ["git"] + cmd, cwd=cwd or self.work_dir, capture_output=True, text=True
+                ["git"] + cmd,
+                cwd=cwd or self.work_dir,
+                stdout=(
+                    subprocess.PIPE
+                    if capture_stdout
+                    else stdout_file or subprocess.DEVNULL
+                ),
+                stderr=subprocess.PIPE,
+                text=text,
             )
-            action.note(f"Exit code: {result.returncode}")
-            if result.stderr:
-                action.note(f"stderr: {result.stderr}")
-            return result.returncode, result.stdout, result.stderr
+            if debug:
+                action.note(f"Exit code: {result.returncode}")
+                if result.stderr:
+                    stderr = (
+                        result.stderr
+                        if text
+                        else result.stderr.decode(errors="replace")
+                    )
+                    action.note(f"stderr: {stderr}")
+            stdout = result.stdout
+            if stdout is None:
+                stdout = "" if text else b""
+            if kind == "cached":
+                self._cache[key] = (result.returncode, stdout, result.stderr)
+            return result.returncode, stdout, result.stderr
+
+    def execute_git_command_to_file(
+        self, cmd: List[str], path: str, cwd: Optional[str] = None
+    ) -> Tuple[int, bytes, bytes]:
+        """Execute a git command, writing its output to a file without buffering it."""
+        with open(path, "wb") as f:
+            return self.execute_git_command(cmd, cwd=cwd, text=False, stdout_file=f)
 
 
 class DiffGenerator(GitCommandExecutor):
@@ -71,13 +300,6 @@ class DiffGenerator(GitCommandExecutor):
         self.diff_dir = diff_dir
         self.patch_to_file: Dict[str, str] = {}  # Maps patch filenames to source files
 
-    def _is_ci_file(self, file_path: str) -> bool:
-        """Check if the file is in one of the CI directories."""
-        return any(
-            file_path.startswith(directory) or fnmatch(file_path, directory)
-            for directory in CI_DIRECTORIES
-        )
-
     def generate_diff(self, base_ref: str, target_ref: str, output_file: str) -> None:
         """Generate a diff between two git references."""
         with Action(f"Generating diff {output_file}") as action:
@@ -89,7 +311,9 @@ class DiffGenerator(GitCommandExecutor):
                     "--output",
                     str(diff_file),
                     f"{base_ref}..{target_ref}",
-                ]
+                ],
+                text=False,
+                capture_stdout=False,
             )
             action.note(f"Generated diff file: {diff_file}")
 
@@ -101,48 +325,43 @@ class DiffGenerator(GitCommandExecutor):
             f"Generating per-file diffs between {base_ref} and {target_ref} for CI directories"
         ) as action:
             self.ensure_diff_dir()
-            # Get list of changed files
+            # Let git limit the diff to the CI directories in a single call.
+            # The options override any user config that changes the patch
+            # headers or leaves them out, as diff.submodule=log does for
+            # submodules
             result = self.execute_git_command(
-                ["diff", "--name-only", base_ref, target_ref]
+                [
+                    "diff",
+                    "--no-color",
+                    "--no-ext-diff",
+                    "--no-textconv",
+                    "--no-renames",
+                    "--submodule=short",
+                    "--src-prefix=a/",
+                    "--dst-prefix=b/",
+                    base_ref,
+                    target_ref,
+                    "--",
+                ]
+                + CI_PATHSPECS,
+                text=False,
             )
-            changed_files = [
-                line.strip() for line in result[1].splitlines() if line.strip()
-            ]
-            if not changed_files:
-                action.note("No changes detected between references.")
-                return
+            if result[0] != 0:
+                raise ValueError(f"Failed to generate diff: {result[2].decode()}")
 
-            # Filter for CI directory files only
-            ci_files = [f for f in changed_files if self._is_ci_file(f)]
-            if not ci_files:
+            patches = split_patch_by_file(result[1])
+            if not patches:
                 action.note("No changes detected in CI directories.")
                 return
 
-            for file in ci_files:
+            for file, segments in patches.items():
                 patch_file = self.diff_dir / f"{prefix}{file.replace('/', '_')}.patch"
-                diff_result = self.execute_git_command(
-                    ["diff", base_ref, target_ref, "--", file]
-                )
-                with open(patch_file, "w") as f:
-                    f.write(diff_result[1])
+                with open(patch_file, "wb") as f:
+                    f.writelines(segments)
                 action.note(f"Generated patch for {file}: {patch_file}")
                 # Store the mapping between patch filename and source file
                 self.patch_to_file[patch_file.name] = file
 
-    def generate_temp_branch_diff(
-        self, base_ref: str, source_branch: str, output_file: str
-    ) -> None:
-        """Generate a diff using a temporary branch."""
-        with Action(f"Generating diff {output_file} using temporary branch") as action:
-            temp_branch = f"temp_{source_branch}"
-            self.execute_git_command(["checkout", "-b", temp_branch, source_branch])
-
-            try:
-                self.generate_diff(base_ref, temp_branch, output_file)
-            finally:
-                self.execute_git_command(["checkout", source_branch])
-                self.execute_git_command(["branch", "-D", temp_branch])
-
     def ensure_diff_dir(self) -> None:
         """Ensure the diff directory exists."""
         self.diff_dir.mkdir(exist_ok=True, parents=True)
@@ -151,9 +370,17 @@ class DiffGenerator(GitCommandExecutor):
 class PatchApplier(GitCommandExecutor):
     """Handles application of git patches and conflict detection."""
 
-    def __init__(self, work_dir: Path, diff_dir: Path) -> None:
+    def __init__(
+        self,
+        work_dir: Path,
+        diff_dir: Path,
+        assume_yes: bool = False,
+        force: bool = False,
+    ) -> None:
         super().__init__(work_dir)
         self.diff_dir = diff_dir
+        self.assume_yes = assume_yes
+        self.force = force
         self.failing_patches: List[Tuple[Path, str]] = (
             []
         )  # List of (patch_file, error_message) tuples
@@ -171,17 +398,18 @@ class PatchApplier(GitCommandExecutor):
         upstream_base_tag: str,
         upstream_new_tag: str,
         custom_branch: str,
-    ) -> Optional[str]:
+    ) -> Optional[bytes]:
         """Try to resolve conflicts using heuristics."""
-        # Get the content of the file in all three states
+        # Get the content of the file in all three states, as raw bytes since
+        # it is only compared and written back
         base_content = self.execute_git_command(
-            ["show", f"refs/tags/{upstream_base_tag}:{file_path}"]
+            ["show", f"refs/tags/{upstream_base_tag}:{file_path}"], text=False
         )[1]
         new_content = self.execute_git_command(
-            ["show", f"refs/tags/{upstream_new_tag}:{file_path}"]
+            ["show", f"refs/tags/{upstream_new_tag}:{file_path}"], text=False
         )[1]
         custom_content = self.execute_git_command(
-            ["show", f"refs/heads/{custom_branch}:{file_path}"]
+            ["show", f"refs/heads/{custom_branch}:{file_path}"], text=False
         )[1]
 
         with Action(f"Trying heuristics for {file_path}") as action:
@@ -215,21 +443,32 @@ class PatchApplier(GitCommandExecutor):
 
         return None
 
-    def apply_patch(
+    def check_patches(self, patch_strs: List[str]) -> Tuple[int, str, str]:
+        """Check whether patch files can be applied, in a single git call."""
+        return self.execute_git_command(["apply", "--check"] + patch_strs)
+
+    def apply_patches(self, patch_strs: List[str]) -> Tuple[int, str, str]:
+        """Apply patch files in a single git call."""
+        return self.execute_git_command(["apply"] + patch_strs)
+
+    def check_patch(
         self,
         patch_file: Path,
+        patch_str: str,
+        result: Tuple[int, str, str],
         new_branch: str,
         upstream_base_tag: str,
         upstream_new_tag: str,
         custom_branch: str,
-    ) -> None:
-        """Apply a patch file and handle conflicts."""
-        with Action(f"Applying patch {patch_file.name}") as action:
-            patch_file = patch_file.resolve()
-            result = self.execute_git_command(["apply", "--check", str(patch_file)])
+    ) -> bool:
+        """Handle the result of checking a patch file, resolving conflicts.
+
+        Returns True if the patch can be applied cleanly.
+        """
+        with Action(f"Checking patch {patch_file.name}") as action:
             if result[0] == 0:
                 action.note("Patch can be applied cleanly")
-                self.execute_git_command(["apply", str(patch_file)])
+                return True
             else:
                 error_message = result[2].strip() if result[2] else "Unknown error"
 
@@ -249,7 +488,7 @@ class PatchApplier(GitCommandExecutor):
                             action.note(
                                 f"File {file_path} already exists with matching content, skipping"
                             )
-                            return
+                            return False
 
                 elif "No such file or directory" in error_message:
                     # Extract the file path from the error message
@@ -260,7 +499,7 @@ class PatchApplier(GitCommandExecutor):
                     )
                     if result[1] == "":
                         action.note(f"File {file_path} was deleted in the new base ref")
-                        return
+                        return False
 
                 elif "patch does not apply" in error_message:
                     # Extract the file path from the error message
@@ -299,9 +538,11 @@ class PatchApplier(GitCommandExecutor):
                         action.note(f"File {file_path} does not exist in custom")
                         action.note("- " + result[1].strip())
                         action.note(f"Would you like to delete it now? [y/N]: ")
-                        if input().lower() == "y":
+                        if confirm_destructive(
+                            assume_yes=self.assume_yes, force=self.force
+                        ):
                             os.remove(self.work_dir / file_path)
-                            return
+                            return False
 
                     elif not exists_in_upstream:
 
@@ -320,14 +561,16 @@ class PatchApplier(GitCommandExecutor):
                             action.note(f"File {file_path} was deleted in upstream")
                             action.note("- " + result[1].strip())
                             action.note(f"Would you like to delete it now? [y/N]: ")
-                            if input().lower() == "y":
+                            if confirm_destructive(
+                                assume_yes=self.assume_yes, force=self.force
+                            ):
                                 os.remove(self.work_dir / file_path)
-                                return
+                                return False
                         else:
                             action.note(
                                 f"File {file_path} is not known to upstream, will keep"
                             )
-                            return
+                            return False
 
                     else:
                         # Try to resolve conflicts using heuristics
@@ -339,15 +582,35 @@ class PatchApplier(GitCommandExecutor):
                         )
                         if resolved_content:
                             # Write the resolved content to the file
-                            with open(self.work_dir / file_path, "w") as f:
+                            with open(self.work_dir / file_path, "wb") as f:
                                 f.write(resolved_content)
                             action.note(
                                 f"Automatically resolved conflicts in {file_path}"
                             )
-                            return
+                            return False
+
+                        # Let git try a three-way merge using the blobs the patch
+                        # records. It also updates the index, but the other
+                        # patches only change the working tree, so the index
+                        # entry is reset afterwards.
+                        result = self.execute_git_command(
+                            ["apply", "--3way", patch_str]
+                        )
+                        if result[0] == 0:
+                            self.execute_git_command(["reset", "-q", "--", file_path])
+                            action.note(f"Merged {file_path} with a three-way merge")
+                            return False
+                        # Restore the file and its index entry from HEAD,
+                        # dropping conflict markers and unmerged stages, so the
+                        # conflict is resolved from a clean file
+                        self.execute_git_command(["checkout", "HEAD", "--", file_path])
+                        action.note(
+                            f"Three-way merge failed, restored {file_path} from HEAD"
+                        )
 
                 action.note(f"Conflict detected: {error_message}")
                 self.failing_patches.append((patch_file, error_message))
+                return False
 
     def apply_changes(
         self,
@@ -360,14 +623,48 @@ class PatchApplier(GitCommandExecutor):
         with Action("Applying changes to new branch") as action:
             self.execute_git_command(["checkout", new_branch])
 
-            for diff_file in sorted(self.diff_dir.glob("custom_*.patch")):
-                self.apply_patch(
-                    diff_file,
-                    new_branch,
-                    upstream_base_tag,
-                    upstream_new_tag,
-                    custom_branch,
+            # Convert the paths to strings once for all the git calls below
+            patches = [
+                (p, str(p))
+                for p in (
+                    p.resolve() for p in sorted(self.diff_dir.glob("custom_*.patch"))
                 )
+            ]
+            patch_strs = [patch_str for _, patch_str in patches]
+
+            # Try all patches at once, only checking them one by one on failure
+            if not patches:
+                clean_patches = []
+            elif self.check_patches(patch_strs)[0] == 0:
+                action.note(f"All {len(patches)} patches can be applied cleanly")
+                clean_patches = patch_strs
+            else:
+                # The checks are read-only, so they can run concurrently
+                with ThreadPoolExecutor(
+                    max_workers=min(GIT_JOBS, len(patches))
+                ) as executor:
+                    results = list(
+                        executor.map(lambda p: self.check_patches([p]), patch_strs)
+                    )
+                clean_patches = [
+                    patch_str
+                    for (patch_file, patch_str), result in zip(patches, results)
+                    if self.check_patch(
+                        patch_file,
+                        patch_str,
+                        result,
+                        new_branch,
+                        upstream_base_tag,
+                        upstream_new_tag,
+                        custom_branch,
+                    )
+                ]
+
+            if clean_patches:
+                result = self.apply_patches(clean_patches)
+                if result[0] != 0:
+                    raise ValueError(f"Failed to apply patches: {result[2]}")
+                action.note(f"Applied {len(clean_patches)} patches")
 
             if self.failing_patches:
                 action.note("Conflicts detected in CI directories.")
@@ -386,6 +683,10 @@ class RebaseManager(GitCommandExecutor):
         work_dir: Path,
         fork_repo: str,
         output_branch: Optional[str] = None,
+        fetch_filter: Optional[str] = "blob:none",
+        fetch_depth: Optional[int] = None,
+        assume_yes: bool = False,
+        force: bool = False,
     ) -> None:
         super().__init__(work_dir)
         self.upstream_new_tag = upstream_new_tag
@@ -396,7 +697,9 @@ class RebaseManager(GitCommandExecutor):
         self.upstream_repo = "https://github.com/ClickHouse/ClickHouse.git"
         self.diff_dir = work_dir / "diffs"
         self.diff_generator = DiffGenerator(work_dir, self.diff_dir)
-        self.patch_applier = PatchApplier(work_dir, self.diff_dir)
+        self.assume_yes = assume_yes
+        self.force = force
+        self.patch_applier = PatchApplier(work_dir, self.diff_dir, assume_yes, force)
 
         self.upstream_new_version = self._extract_version_number(upstream_new_tag)
         self.upstream_base_version = self._extract_version_number(upstream_base_tag)
@@ -405,10 +708,16 @@ class RebaseManager(GitCommandExecutor):
             raise ValueError("Failed to extract version information from tags")
 
         self.output_branch = output_branch or f"rebase-cicd-{self.upstream_new_tag}"
-
-    def _extract_version_number(self, tag: str) -> Optional[str]:
+        self.fetch_filter = fetch_filter
+        self.fetch_depth = fetch_depth
+        self._current_branch: Optional[str] = None
+        self._remotes_verified: Set[str] = set()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _extract_version_number(tag: str) -> Optional[str]:
         """Extract version number from tag."""
-        match = re.search(r"v([\d.]+(?:-[a-z]+)?)", tag)
+        match = TAG_VERSION_RE.search(tag)
         return match.group(1) if match else None
 
     def is_directory_empty(self, missing_ok: bool = False) -> bool:
@@ -416,48 +725,96 @@ class RebaseManager(GitCommandExecutor):
         if not self.work_dir.exists():
             return missing_ok
 
+        # An existing repository is never empty, no need to scan it
+        if (self.work_dir / ".git").exists():
+            return False
+
+        # Stop at the first visible entry instead of listing the whole directory
         with os.scandir(self.work_dir) as entries:
-            return all(entry.name.startswith(".") for entry in entries)
+            for entry in entries:
+                if not entry.name.startswith("."):
+                    return False
+        return True
+
+    def _remote_urls(self) -> Dict[str, str]:
+        """Get the URLs of all configured remotes with a single git call."""
+        result = self.execute_git_command(
+            ["config", "--get-regexp", r"^remote\..*\.url$"]
+        )
+        remote_urls = {}
+        for line in result[1].splitlines():
+            key, _, url = line.partition(" ")
+            remote_urls[key[len("remote.") : -len(".url")]] = url
+        return remote_urls
+
+    def _local_tags(self) -> Set[str]:
+        """Get the names of all local tags with a single git call."""
+        result = self.execute_git_command(
+            ["for-each-ref", "--format=%(refname:strip=2)", "refs/tags"]
+        )
+        return set(result[1].split())
+
+    def _get_remote_url(self, remote_name: str) -> Optional[str]:
+        """Get the URL of a remote, or None if it is not configured."""
+        return self._remote_urls().get(remote_name)
+
+    def _get_current_branch(self) -> str:
+        """Get the checked out branch, memoized until the next checkout."""
+        if self._current_branch is None:
+            r = self.execute_git_command(["rev-parse", "--abbrev-ref", "HEAD"])
+            self._current_branch = r[1].strip()
+        return self._current_branch
+
+    def _checkout(self, cmd: List[str], branch: str) -> Tuple[int, str, str]:
+        """Run a git checkout command and remember the resulting branch."""
+        result = self.execute_git_command(["checkout"] + cmd)
+        self._current_branch = branch if result[0] == 0 else None
+        return result
 
     def _handle_remote(
         self, remote_name: str, expected_url: str, action: Action
     ) -> None:
         """Validate remote configuration."""
-        result = self.execute_git_command(["remote", "get-url", remote_name])
-        if result[0] != 0:
-            if remote_name == "upstream":
-                action.note(f"Upstream remote not found, will add it")
-            else:
-                raise ValueError(f"{remote_name.capitalize()} remote not found")
-        elif result[1].strip() != expected_url:
-            if remote_name == "upstream":
-                action.note(
-                    f"Upstream remote URL mismatch. Expected: {expected_url}, Got: {result[1].strip()}"
-                )
-                action.note("Will update upstream remote URL")
-            else:
-                raise ValueError(
-                    f"{remote_name.capitalize()} remote does not match. Expected: {expected_url}, Got: {result[1].strip()}"
-                )
+        url = self._get_remote_url(remote_name)
+        if url is None:
+            raise ValueError(f"{remote_name.capitalize()} remote not found")
+        elif url != expected_url:
+            raise ValueError(
+                f"{remote_name.capitalize()} remote does not match. Expected: {expected_url}, Got: {url}"
+            )
 
     def _setup_remote(self, remote_name: str, url: str, action: Action) -> None:
         """Set up or update a remote."""
-        result = self.execute_git_command(["remote", "get-url", remote_name])
-        if result[0] != 0:
+        if remote_name in self._remotes_verified:
+            return
+        current_url = self._get_remote_url(remote_name)
+        if current_url is None:
             self.execute_git_command(["remote", "add", remote_name, url])
             action.note(f"Added {remote_name} remote: {url}")
-        elif result[1].strip() != url:
+        elif current_url != url:
+            action.note(
+                f"{remote_name.capitalize()} remote URL mismatch. Expected: {url}, Got: {current_url}"
+            )
             self.execute_git_command(["remote", "set-url", remote_name, url])
             action.note(f"Updated {remote_name} remote URL to: {url}")
+        self._remotes_verified.add(remote_name)
+
+    @staticmethod
+    def _parse_branch_header(header: str) -> str:
+        """Extract the current branch from a `git status --branch` header line."""
+        header = header[len("## ") :]
+        if header.startswith("No commits yet on "):
+            header = header[len("No commits yet on ") :]
+        return header.split("...", 1)[0].split(" ", 1)[0]
 
     def validate_working_directory(self) -> None:
         """Validate the working directory state."""
         with Action("Validating working directory") as action:
             if not (self.work_dir / ".git").exists():
-                response = input(
-                    "Not a git repository. Would you like to do a clean clone of the fork repository? (y/n): "
-                )
-                if response.lower() == "y":
+                if confirm(
+                    "Not a git repository. Would you like to do a clean clone of the fork repository? (y/n): ",
+                    self.assume_yes,
+                ):
                     self.clone_repository()
                     return
                 else:
@@ -468,39 +825,64 @@ class RebaseManager(GitCommandExecutor):
             # First check if diffs directory exists and has content
             if (self.work_dir / "diffs").exists():
                 action.note("Previous 'diffs' directory found")
-                response = input(
-                    "Would you like to remove the previous diffs directory? (y/n): "
-                )
-                if response.lower() == "y":
-                    shutil.rmtree(self.work_dir / "diffs")
+                if confirm(
+                    "Would you like to remove the previous diffs directory? (y/n): ",
+                    self.assume_yes,
+                ):
+                    # Move the directory into a new, uniquely named one and
+                    # delete that while the rest of the setup runs
+                    trash_dir = tempfile.mkdtemp(
+                        prefix=".diffs.trash.", dir=self.work_dir
+                    )
+                    os.replace(
+                        self.work_dir / "diffs", os.path.join(trash_dir, "diffs")
+                    )
+                    threading.Thread(
+                        target=shutil.rmtree,
+                        args=(trash_dir,),
+                        kwargs={"ignore_errors": True},
+                    ).start()
                 else:
                     raise ValueError(
                         "Please remove or backup the existing diffs directory"
                     )
 
-            # Then check for tracked file changes only
-            result = self.execute_git_command(["diff", "--name-only"])
-            if result[1].strip():
+            # Then check for tracked file changes only, getting the current branch
+            # from the same call. Load the remote URLs concurrently, as the two
+            # queries are independent.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                status = executor.submit(
+                    self.execute_git_command,
+                    ["status", "--porcelain=v1", "--branch", "--untracked-files=no"],
+                )
+                executor.submit(self._remote_urls).result()
+                r = status.result()
+            header, *changes = r[1].splitlines() or [""]
+            if changes:
                 raise ValueError(
                     "Working directory has uncommitted changes to tracked files. Please commit or stash them first."
                 )
 
             self._handle_remote("origin", self.fork_repo, action)
-            self._handle_remote("upstream", self.upstream_repo, action)
+            self._setup_remote("upstream", self.upstream_repo, action)
 
-            r = self.execute_git_command(["rev-parse", "--abbrev-ref", "HEAD"])
-            current_branch = r[1].strip()
+            self._current_branch = self._parse_branch_header(header)
+            current_branch = self._get_current_branch()
             if current_branch != self.custom_branch:
                 action.note(
                     f"Switching from '{current_branch}' to '{self.custom_branch}'"
                 )
-                self.execute_git_command(["fetch", "origin", self.custom_branch])
-                r = self.execute_git_command(["checkout", self.custom_branch])
+                self.execute_git_command(
+                    PARALLEL_OPTIONS + ["fetch", "origin", self.custom_branch]
+                )
+                r = self._checkout([self.custom_branch], self.custom_branch)
             if r[0] != 0:
                 raise ValueError(
                     f"Failed to checkout branch '{self.custom_branch}': {r[2]}"
                 )
-            self.execute_git_command(["pull", "origin", self.custom_branch])
+            self.execute_git_command(
+                PARALLEL_OPTIONS + ["pull", "origin", self.custom_branch]
+            )
 
     def clone_repository(self) -> None:
         """Clone the fork repository if the directory is empty."""
@@ -508,11 +890,11 @@ class RebaseManager(GitCommandExecutor):
             if self.is_directory_empty(missing_ok=True):
                 action.note(f"Directory is empty, cloning {self.fork_repo}")
                 self.execute_git_command(
-                    ["clone", self.fork_repo, self.work_dir.name],
+                    PARALLEL_OPTIONS + ["clone", self.fork_repo, self.work_dir.name],
                     cwd=self.work_dir.parent,
                 )
                 self._setup_remote("upstream", self.upstream_repo, action)
-                self.execute_git_command(["checkout", self.custom_branch])
+                self._checkout([self.custom_branch], self.custom_branch)
                 action.note(f"Checked out branch: {self.custom_branch}")
             else:
                 action.note("Directory is not empty, skipping clone")
@@ -522,21 +904,40 @@ class RebaseManager(GitCommandExecutor):
         with Action("Setting up workspace") as action:
             self.clone_repository()
             self.validate_working_directory()
-            self._setup_remote("upstream", self.upstream_repo, action)
+            self.fetch_upstream_tags(action)
+
+    def fetch_upstream_tags(self, action: Action) -> None:
+        """Fetch the upstream tags that are missing locally, in a single fetch."""
+        local_tags = self._local_tags()
+        tags = [
+            tag
+            for tag in (self.upstream_base_tag, self.upstream_new_tag)
+            if tag not in local_tags
+        ]
+        if not tags:
+            action.note("Upstream tags already present, skipping fetch")
+            return
+
+        cmd = PARALLEL_OPTIONS + ["fetch", "--no-tags"]
+        if self.fetch_filter:
+            # Mark upstream as a promisor remote so that git can fetch the
+            # filtered out objects on demand
+            self.execute_git_command(["config", "remote.upstream.promisor", "true"])
             self.execute_git_command(
-                [
-                    "fetch",
-                    "upstream",
-                    f"refs/tags/{self.upstream_base_tag}:refs/tags/{self.upstream_base_tag}",
-                ]
+                ["config", "remote.upstream.partialclonefilter", self.fetch_filter]
             )
-            self.execute_git_command(
-                [
-                    "fetch",
-                    "upstream",
-                    f"refs/tags/{self.upstream_new_tag}:refs/tags/{self.upstream_new_tag}",
-                ]
+            cmd.append(f"--filter={self.fetch_filter}")
+        if self.fetch_depth:
+            # A shallow fetch cuts the history off at the tags, so files deleted
+            # upstream between them can no longer be found by check_patch
+            action.note(
+                f"Fetching {self.fetch_depth} commits of history, files deleted "
+                "upstream may not be detected"
             )
+            cmd.append(f"--depth={self.fetch_depth}")
+        cmd.append("upstream")
+        cmd.extend(f"refs/tags/{tag}:refs/tags/{tag}" for tag in tags)
+        self.execute_git_command(cmd)
 
     def generate_custom_base_diff(self) -> None:
         """Generate per-file diffs between custom branch and base tag."""
@@ -557,38 +958,39 @@ class RebaseManager(GitCommandExecutor):
         """Create a new branch based on the upstream tag."""
         with Action("Creating new branch based on upstream tag") as action:
             # Check if branch already exists
+            create_flag = "-b"
             result = self.execute_git_command(
                 ["show-ref", "--verify", f"refs/heads/{self.output_branch}"]
             )
             if result[0] == 0:
                 action.note(f"Branch {self.output_branch} already exists")
                 action.note(f"Would you like to delete and recreate it? [y/N]: ")
-                if input().lower() != "y":
+                if not confirm_destructive(
+                    assume_yes=self.assume_yes, force=self.force
+                ):
                     raise ValueError(f"Branch {self.output_branch} already exists")
-                result = self.execute_git_command(["branch", "-D", self.output_branch])
-                if result[0] != 0:
-                    raise ValueError(f"Failed to delete existing branch: {result[2]}")
+                # Reset the existing branch instead of deleting it
+                create_flag = "-B"
 
-            # Create branch directly from the tag
-            result = self.execute_git_command(
-                ["branch", self.output_branch, f"refs/tags/{self.upstream_new_tag}"]
+            # Create and check out the branch directly from the tag
+            result = self._checkout(
+                [create_flag, self.output_branch, f"refs/tags/{self.upstream_new_tag}"],
+                self.output_branch,
             )
             if result[0] != 0:
                 raise ValueError(f"Failed to create branch: {result[2]}")
-            result = self.execute_git_command(["checkout", self.output_branch])
-            if result[0] != 0:
-                raise ValueError(f"Failed to checkout new branch: {result[2]}")
             action.note(f"Created new branch: {self.output_branch}")
             return self.output_branch
 
     def apply_changes(self, new_branch: str) -> None:
         """Apply changes to the new branch."""
-        self.patch_applier.apply_changes(
-            new_branch,
-            self.upstream_base_tag,
-            self.upstream_new_tag,
-            self.custom_branch,
-        )
+        with self.patch_applier.fast_index():
+            self.patch_applier.apply_changes(
+                new_branch,
+                self.upstream_base_tag,
+                self.upstream_new_tag,
+                self.custom_branch,
+            )
 
     def resolve_conflicts_interactively(self, new_branch: str) -> None:
         """Interactively resolve conflicts using meld."""
@@ -608,21 +1010,19 @@ class RebaseManager(GitCommandExecutor):
 
                 try:
                     # Get content from base and custom states
-                    with open(base_file, "w") as f:
-                        f.write(
-                            self.execute_git_command(
-                                ["show", f"{self.upstream_base_tag}:{file_path}", "--"]
-                            )[1]
-                        )
-                    with open(custom_file, "w") as f:
-                        f.write(
-                            self.execute_git_command(
-                                ["show", f"{self.custom_branch}:{file_path}", "--"]
-                            )[1]
-                        )
+                    self.execute_git_command_to_file(
+                        ["show", f"{self.upstream_base_tag}:{file_path}", "--"],
+                        base_file,
+                    )
+                    self.execute_git_command_to_file(
+                        ["show", f"{self.custom_branch}:{file_path}", "--"],
+                        custom_file,
+                    )
 
                     action.note(f"({i+1}/{num_patches}) Opening meld for {file_path}")
-                    action.note("Please merge custom changes into new and save the file")
+                    action.note(
+                        "Please merge custom changes into new and save the file"
+                    )
                     action.note("Press Enter when done...")
 
                     # Open meld with base, new, and the actual file
@@ -661,6 +1061,27 @@ def parse_args() -> argparse.Namespace:
         default="https://github.com/Altinity/ClickHouse.git",
         help="Fork repository URL (default: https://github.com/Altinity/ClickHouse.git)",
     )
+    parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Answer yes to all prompts, except for interactive conflict resolution, and no to prompts that delete files or reset an existing output branch",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Answer yes to prompts that delete files or reset an existing output branch",
+    )
+    parser.add_argument(
+        "--fetch-filter",
+        default="blob:none",
+        help="Object filter for fetching upstream tags, empty to fetch everything (default: blob:none)",
+    )
+    parser.add_argument(
+        "--fetch-depth",
+        type=int,
+        help="Commits of history to fetch for upstream tags, files deleted upstream may not be detected (default: full history)",
+    )
     parser.add_argument(
         "--work-dir",
         type=Path,
@@ -692,6 +1113,10 @@ def main() -> None:
             args.work_dir,
             args.fork_repo,
             args.output_branch,
+            args.fetch_filter,
+            args.fetch_depth,
+            args.yes,
+            args.force,
         )
 
         action.note("Starting rebase process")
@@ -717,7 +1142,7 @@ def main() -> None:
                 error_message,
             ) in rebase_manager.patch_applier.failing_patches:
                 file_path = rebase_manager.diff_generator.patch_to_file.get(
-                    patch_file, str(patch_file)
+                    patch_file.name, str(patch_file)
                 )
                 error_message = error_message.split(":")[-1].strip()
                 error_code = error_codes.get(error_message, error_message)
@@ -728,10 +1153,10 @@ def main() -> None:
             for error_message, error_code in error_codes.items():
                 action.note(f"{error_code}: {error_message}")
 
-            response = input(
+            # Resolving conflicts needs a person, so --yes leaves them for later
+            if not args.yes and confirm(
                 "\nWould you like to resolve conflicts interactively now? (y/n): "
-            )
-            if response.lower() == "y":
+            ):
                 rebase_manager.resolve_conflicts_interactively(new_branch)
                 action.note("After resolving all conflicts, commit your changes:")
             else:
@@ -5,49 +5,190 @@ This script scans an S3 bucket, files, or directories for leaked strings in vari
 Python dependencies:
 - boto3
 - zstandard (optional, for .zst files)
+- google-re2 (optional, for faster pattern matching)
+- pyahocorasick (optional, for searching many secrets in a single pass)
+- libarchive-c (optional, for reading .deb and .rpm files in-process)
 
-External dependencies:
+External dependencies (when libarchive-c is not installed):
 - dpkg-deb (for .deb files)
-- rpm2cpio and cpio (for .rpm files)
+- rpm2cpio (for .rpm files)
 """
 
+import collections
+import contextlib
+import functools
 import tarfile
 import zipfile
 import gzip
 import re
 import io
+import mmap
 import argparse
 import subprocess
 import os
-from tempfile import NamedTemporaryFile
+import shutil
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 
 import boto3
+from botocore.config import Config
 
 try:
     import zstandard as zstd
 except ImportError:
     print("WARNING: zstandard package not found. Install with `pip install zstandard`")
 
-# Initialize S3 client
-s3 = boto3.client("s3")
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import libarchive
+except ImportError:
+    libarchive = None
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client(max_pool_connections=10):
+    """Get a shared S3 client with a connection for each parallel scan."""
+    return boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
+            retries={"max_attempts": 10, "mode": "adaptive"},
+        ),
+    )
+
+
+def compile_pattern(pattern):
+    """Compile a bytes pattern with RE2 if available, otherwise with re."""
+    if re2 is not None:
+        # RE2 matches in linear time, but lacks lookarounds and backreferences
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass
+    return re.compile(pattern)
+
+
+# Size of the blocks that streamed files are scanned in
+CHUNK_SIZE = 1 << 20
+
+# Longest run of data without a newline that is scanned as a single line.
+# Longer runs, usually binary data, are scanned in windows that overlap by
+# LINE_OVERLAP bytes, so that matches at the window edges are not cut off
+MAX_LINE_SIZE = 16 * CHUNK_SIZE
+LINE_OVERLAP = 4096
+
+# Size up to which zip archives that can't be seeked are buffered in memory
+ZIP_SPOOL_SIZE = 64 << 20
+
+# Printable ASCII and common whitespace, for telling text from binary data
+TEXT_BYTES = bytes(range(32, 127)) + b"\t\n\r"
+
+
+def is_probably_text(head):
+    """Check if data looks like text, judging by its first bytes."""
+    if not head:
+        return True
+    # Like grep, treat NUL bytes as binary, which also catches compressed data
+    if b"\0" in head:
+        return False
+    return len(head.translate(None, TEXT_BYTES)) * 10 < len(head) * 7
+
+
+def count_newlines(buffer, start, end):
+    """Count the newlines in a slice of a buffer, a chunk at a time."""
+    count = 0
+    for position in range(start, end, CHUNK_SIZE):
+        count += buffer[position : min(position + CHUNK_SIZE, end)].count(b"\n")
+    return count
+
+
+def check_returncode(process):
+    """Raise an error if a finished process exited with a non-zero status."""
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def map_bounded(executor, function, items, window):
+    """Like executor.map, but only submit up to window items ahead of the results.
+
+    Items are taken from the iterable as results are consumed, instead of all
+    at once, and the items not started yet are cancelled if a call fails.
+    """
+    futures = collections.deque()
+    try:
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class BlockStream(io.RawIOBase):
+    """Read-only stream over an iterator of byte blocks."""
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.block = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.block:
+            self.block = next(self.blocks, None)
+            if self.block is None:
+                self.block = b""
+                return 0
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
 
 
 class LeakScanner:
 
     def __init__(
-        self, bucket_name=None, prefix=None, env_secrets_only=False, pattern=None
+        self,
+        bucket_name=None,
+        prefix=None,
+        env_secrets_only=False,
+        pattern=None,
+        jobs=8,
+        skip_binary=False,
     ):
         self.bucket_name = bucket_name
         self.prefix = prefix
-        self.pattern = re.compile(
-            pattern or r"[A-Z_]*(SECRET|PASSWORD|ACCESS_KEY|TOKEN)[A-Z_]*"
+        # Compiled as bytes to match the raw file contents without decoding
+        self.pattern = compile_pattern(
+            (pattern or r"[A-Z_]*(SECRET|PASSWORD|ACCESS_KEY|TOKEN)[A-Z_]*").encode()
         )
-        print(self.pattern)
-        exit()
         self.sensitive_strings = []
+        self.sensitive_patterns = []
+        self.sensitive_automaton = None
+        self.longest_secret = 0
         self.matches = []
         self.continuation_token = None
         self.env_secrets_only = env_secrets_only
+        self.jobs = jobs
+        self.skip_binary = skip_binary
+        # zstd decompression contexts can't be used by several threads at once
+        self.thread_local = threading.local()
 
         # Mapping of file extensions to their respective scanning functions
         self.extension_to_scan_function = {
@@ -62,186 +203,401 @@ class LeakScanner:
             ".rpm": self.scan_rpm,
         }
 
+    def get_scan_function(self, file_name):
+        """Get the scan function for the longest known extension of a file."""
+        base_name = os.path.basename(file_name)
+        # Try the suffixes from the first dot on, so that ".tar.gz" is matched
+        # before ".gz" regardless of the mapping order
+        index = base_name.find(".")
+        while index != -1:
+            scan_function = self.extension_to_scan_function.get(base_name[index:])
+            if scan_function:
+                return scan_function
+            index = base_name.find(".", index + 1)
+        return None
+
     def scan_env_vars(self):
         """Scan environment variables for sensitive strings."""
         for var_name, var_value in os.environ.items():
-            if self.pattern.match(var_name):
+            # Empty values would match everywhere
+            if var_value and self.pattern.match(var_name.encode()):
                 self.sensitive_strings.append(var_value)
 
+        if not self.sensitive_strings:
+            return
+        secrets = set(self.sensitive_strings)
+        self.longest_secret = max(len(secret.encode()) for secret in secrets)
+        if ahocorasick is not None and ahocorasick.unicode:
+            # An Aho-Corasick automaton finds all the values in a single pass,
+            # including values that overlap or contain one another. It works
+            # on str, which latin-1 maps one to one onto the bytes
+            self.sensitive_automaton = ahocorasick.Automaton()
+            for secret in secrets:
+                self.sensitive_automaton.add_word(
+                    secret.encode().decode("latin-1"), secret.encode()
+                )
+            self.sensitive_automaton.make_automaton()
+        else:
+            # Search for each value separately, as an alternation reports only
+            # one of the values that overlap or contain one another
+            self.sensitive_patterns = [
+                compile_pattern(re.escape(secret.encode())) for secret in secrets
+            ]
+
     def scan_file(self, file_content, file_name):
         """Scan the content of a file for leaked strings."""
+        if self.skip_binary and not is_probably_text(file_content[:4096]):
+            return []
+        return self.scan_lines(file_content, file_name)
+
+    def scan_stream(self, stream, file_name):
+        """Scan a file read from a binary stream, a chunk of lines at a time."""
+        chunk = stream.read(CHUNK_SIZE)
+        if self.skip_binary and not is_probably_text(chunk[:4096]):
+            return []
+
+        matches = []
+        first_line = 1
+        # The chunks read since the last newline, so only the newest chunk
+        # needs to be searched for one
+        pending = []
+        pending_size = 0
+        # Shared by the windows of a long line, to report each value once
+        seen_secrets = set()
+        while chunk:
+            # Carry the last partial line over to the next chunk, so that
+            # matches never span two chunks
+            end = chunk.rfind(b"\n") + 1
+            if end:
+                lines = b"".join(pending + [chunk[:end]])
+                matches.extend(
+                    self.scan_lines(lines, file_name, first_line, seen_secrets)
+                )
+                first_line += chunk.count(b"\n", 0, end)
+                pending = [chunk[end:]]
+                pending_size = len(chunk) - end
+            else:
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size > MAX_LINE_SIZE:
+                    # Scan the line so far, only keeping its end for the next
+                    # window, as a line this long is most likely binary data
+                    line = b"".join(pending)
+                    found = self.find_matches(line)
+                    # Cut before a pattern match that crosses the end of the
+                    # window, so that it is reported whole from the next one.
+                    # Values that start before the cut end inside the window
+                    cut = len(line) - max(LINE_OVERLAP, self.longest_secret)
+                    for offset, kind, text in found:
+                        if kind == 0 and offset < cut < offset + len(text):
+                            cut = offset
+                    matches.extend(
+                        self.report_matches(
+                            line,
+                            [match for match in found if match[0] < cut],
+                            file_name,
+                            first_line,
+                            seen_secrets,
+                        )
+                    )
+                    pending = [line[cut:]]
+                    pending_size = len(line) - cut
+            chunk = stream.read(CHUNK_SIZE)
+        if pending_size:
+            matches.extend(
+                self.scan_lines(b"".join(pending), file_name, first_line, seen_secrets)
+            )
+        return matches
+
+    def scan_lines(self, file_content, file_name, first_line=1, seen_secrets=None):
+        """Scan whole lines of a file, starting at the given line number."""
+        return self.report_matches(
+            file_content,
+            self.find_matches(file_content),
+            file_name,
+            first_line,
+            seen_secrets,
+        )
+
+    def find_matches(self, file_content):
+        """Find the offset, kind and text of the matches in a buffer.
+
+        Matches of the pattern are of kind 0, and sensitive values of kind 1.
+        """
+        # Sweep the whole buffer with each pattern, keeping the match offsets
+        found = []
+        if not self.env_secrets_only:
+            for match in self.pattern.finditer(file_content):
+                found.append((match.start(), 0, match.group(0)))
+        for sensitive_pattern in self.sensitive_patterns:
+            for match in sensitive_pattern.finditer(file_content):
+                found.append((match.start(), 1, match.group(0)))
+        if self.sensitive_automaton:
+            # Search a window at a time, so that a memory-mapped file is never
+            # decoded in full. The windows overlap by the longest value, so
+            # each match is found whole in the window it starts in
+            overlap = self.longest_secret - 1
+            for start in range(0, len(file_content), CHUNK_SIZE):
+                stop = start + CHUNK_SIZE
+                window = str(file_content[start : stop + overlap], "latin-1")
+                for last, secret in self.sensitive_automaton.iter(window):
+                    offset = start + last - len(secret) + 1
+                    if offset < stop:
+                        found.append((offset, 1, secret))
+        return found
+
+    def report_matches(
+        self, file_content, found, file_name, first_line=1, seen_secrets=None
+    ):
+        """Report the matches found in a buffer on the lines they start on.
+
+        Values already in seen_secrets, by (line number, value), are skipped.
+        """
+        if not found:
+            return []
+
+        # Line numbers are only needed for files with matches, and are found
+        # by counting the newlines between one match and the next
+        numbered = []
+        line_number = first_line
+        position = 0
+        for offset, kind, text in sorted(found):
+            line_number += count_newlines(file_content, position, offset)
+            position = offset
+            numbered.append((line_number, kind, text))
+
         matches = []
-        for line_number, line in enumerate(file_content.splitlines(), start=1):
-            if not self.env_secrets_only:
-                for match in self.pattern.finditer(line):
-                    matches.append((file_name, line_number, match.group(0)))
-            for secret_string in self.sensitive_strings:
-                if secret_string in line:
-                    matches.append((file_name, line_number, f"{secret_string[:4]}..."))
+        if seen_secrets is None:
+            seen_secrets = set()
+        for line_number, kind, text in sorted(numbered):
+            text = text.decode("utf-8", errors="replace")
+            if kind == 0:
+                matches.append((file_name, line_number, text))
+            elif (line_number, text) not in seen_secrets:
+                # Report each value once per line
+                seen_secrets.add((line_number, text))
+                matches.append((file_name, line_number, f"{text[:4]}..."))
         return matches
 
     def scan_local_file(self, file_path):
         """Scan a single local file for leaked strings."""
         matches = []
         try:
-            # Check the file extension and use the appropriate scan function
-            for extension, scan_function in self.extension_to_scan_function.items():
-                if file_path.endswith(extension):
-                    with open(file_path, "rb") as f:
-                        file_content = f.read()
-                    matches.extend(scan_function(file_content, file_path))
+            with open(file_path, "rb") as f:
+                # Check the file extension and use the appropriate scan function
+                scan_function = self.get_scan_function(file_path)
+                if scan_function:
+                    matches.extend(scan_function(f, file_path))
                     return matches
 
-            # If no special handling is required, scan as a plain text file
-            with open(file_path, "rb") as f:
-                file_content = f.read()
-            matches.extend(
-                self.scan_file(file_content.decode("utf-8", errors="ignore"), file_path)
-            )
+                # If no special handling is required, scan as a plain text file.
+                # Map it into memory instead of reading a copy of it, unless
+                # it is empty or has no known size, which can't be mapped
+                if os.fstat(f.fileno()).st_size == 0:
+                    matches.extend(self.scan_file(f.read(), file_path))
+                    return matches
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as file_content:
+                    if hasattr(mmap, "MADV_SEQUENTIAL"):
+                        file_content.madvise(mmap.MADV_SEQUENTIAL)
+                    matches.extend(self.scan_file(file_content, file_path))
         except Exception as e:
             print(f"Error reading file {file_path}: {e}")
         return matches
 
-    def scan_local_directory(self, directory_path):
-        """Recursively scan a directory for leaked strings."""
-        matches = []
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                matches.extend(self.scan_local_file(file_path))
-        return matches
-
-    def scan_paths(self, paths):
-        """Scan a list of files and directories for leaked strings."""
-        matches = []
+    def iter_local_files(self, paths):
+        """Yield the files in a list of files and directories."""
         for path in paths:
             if os.path.isfile(path):
-                matches.extend(self.scan_local_file(path))
+                yield path
             elif os.path.isdir(path):
-                matches.extend(self.scan_local_directory(path))
+                for root, _, files in os.walk(path):
+                    for file in files:
+                        yield os.path.join(root, file)
             else:
                 print(f"Invalid path: {path}")
-        return matches
 
-    def scan_tar(self, file_content, package_name):
-        """Scan the contents of a tar archive for leaked strings."""
+    def scan_local_files(self, file_paths):
+        """Scan local files in parallel, keeping the results in order."""
         matches = []
-        with tarfile.open(fileobj=io.BytesIO(file_content), mode="r:") as tar:
-            for member in tar.getmembers():
-                if member.isfile():
-                    f = tar.extractfile(member)
-                    if f:
-                        file_content = f.read().decode("utf-8", errors="ignore")
-                        matches.extend(
-                            self.scan_file(
-                                file_content, f"{package_name}/{member.name}"
-                            )
-                        )
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for file_matches in map_bounded(
+                executor, self.scan_local_file, file_paths, 2 * self.jobs
+            ):
+                matches.extend(file_matches)
         return matches
 
-    def scan_tar_gz(self, file_content, package_name):
-        """Scan the contents of a tar.gz or tgz archive for leaked strings."""
+    def scan_local_directory(self, directory_path):
+        """Recursively scan a directory for leaked strings."""
+        return self.scan_local_files(self.iter_local_files([directory_path]))
+
+    def scan_paths(self, paths):
+        """Scan a list of files and directories for leaked strings."""
+        return self.scan_local_files(self.iter_local_files(paths))
+
+    def scan_tar_stream(self, tar, package_name):
+        """Scan the members of a tar archive opened in streaming mode."""
         matches = []
-        with tarfile.open(fileobj=io.BytesIO(file_content), mode="r:gz") as tar:
-            for member in tar.getmembers():
-                if member.isfile():
-                    f = tar.extractfile(member)
-                    if f:
-                        file_content = f.read().decode("utf-8", errors="ignore")
-                        matches.extend(
-                            self.scan_file(
-                                file_content, f"{package_name}/{member.name}"
-                            )
+        # Iterating reads the members as they come, unlike getmembers() which
+        # needs to go through the whole archive first
+        for member in tar:
+            if member.isfile():
+                f = tar.extractfile(member)
+                if f:
+                    matches.extend(
+                        self.scan_stream(
+                            f, f"{package_name}/{member.name.removeprefix('./')}"
                         )
+                    )
         return matches
 
-    def scan_gz(self, file_content, file_name):
+    def scan_tar(self, fileobj, package_name):
+        """Scan the contents of a tar archive for leaked strings."""
+        with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+            return self.scan_tar_stream(tar, package_name)
+
+    def scan_tar_gz(self, fileobj, package_name):
+        """Scan the contents of a tar.gz or tgz archive for leaked strings."""
+        # Decompress with gzip into large buffered reads, which is faster
+        # than the small record-sized reads of tarfile's own "r|gz" stream
+        with gzip.GzipFile(fileobj=fileobj) as gz:
+            reader = io.BufferedReader(gz, buffer_size=1 << 20)
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                return self.scan_tar_stream(tar, package_name)
+
+    def scan_gz(self, fileobj, file_name):
         """Scan the contents of a gzipped file for leaked strings."""
-        matches = []
-        with gzip.GzipFile(fileobj=io.BytesIO(file_content)) as gz:
-            file_content = gz.read().decode("utf-8", errors="ignore")
-            matches.extend(self.scan_file(file_content, file_name))
-        return matches
+        with gzip.GzipFile(fileobj=fileobj) as gz:
+            return self.scan_stream(gz, file_name)
+
+    def zstd_decompressor(self):
+        """Get the zstd decompression context of the current thread."""
+        dctx = getattr(self.thread_local, "zstd_decompressor", None)
+        if dctx is None:
+            dctx = self.thread_local.zstd_decompressor = zstd.ZstdDecompressor()
+        return dctx
 
-    def scan_tar_zst(self, file_content, package_name):
+    def scan_tar_zst(self, fileobj, package_name):
         """Scan the contents of a tar.zst archive for leaked strings."""
-        matches = []
-        dctx = zstd.ZstdDecompressor()
-        with dctx.stream_reader(io.BytesIO(file_content)) as reader:
+        dctx = self.zstd_decompressor()
+        with dctx.stream_reader(fileobj, read_across_frames=True) as reader:
             with tarfile.open(fileobj=reader, mode="r|") as tar:
-                for member in tar.getmembers():
-                    if member.isfile():
-                        f = tar.extractfile(member)
-                        if f:
-                            file_content = f.read().decode("utf-8", errors="ignore")
-                            matches.extend(
-                                self.scan_file(
-                                    file_content, f"{package_name}/{member.name}"
-                                )
-                            )
-        return matches
+                return self.scan_tar_stream(tar, package_name)
 
-    def scan_zst(self, file_content, file_name):
+    def scan_zst(self, fileobj, file_name):
         """Scan the contents of a zst file for leaked strings."""
-        matches = []
-        dctx = zstd.ZstdDecompressor()
-        file_content = dctx.decompress(file_content).decode("utf-8", errors="ignore")
-        matches.extend(self.scan_file(file_content, file_name))
-        return matches
+        dctx = self.zstd_decompressor()
+        # Stream the frames, as they do not always record the content size
+        with dctx.stream_reader(fileobj, read_across_frames=True) as reader:
+            return self.scan_stream(reader, file_name)
 
-    def scan_zip(self, file_content, package_name):
+    def scan_zip(self, fileobj, package_name):
         """Scan the contents of a zip archive for leaked strings."""
+        if not fileobj.seekable():
+            # The zip index is at the end of the archive, so it needs random
+            # access. Copy the archive to a buffer that spills over to disk
+            # when it gets large instead of holding all of it in memory
+            with SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE) as spool:
+                shutil.copyfileobj(fileobj, spool, CHUNK_SIZE)
+                spool.seek(0)
+                return self.scan_zip(spool, package_name)
+
         matches = []
-        with zipfile.ZipFile(io.BytesIO(file_content)) as zip:
+        with zipfile.ZipFile(fileobj) as zip:
             for member in zip.infolist():
                 with zip.open(member) as f:
-                    file_content = f.read().decode("utf-8", errors="ignore")
                     matches.extend(
-                        self.scan_file(
-                            file_content, f"{package_name}/{member.filename}"
-                        )
+                        self.scan_stream(f, f"{package_name}/{member.filename}")
                     )
         return matches
 
-    def scan_deb(self, file_content, package_name):
-        """Scan the contents of a .deb package for leaked strings."""
+    def scan_cpio_stream(self, stream, package_name):
+        """Scan the files of a new ASCII (newc) cpio archive read from a stream."""
         matches = []
-        with NamedTemporaryFile(delete=False, suffix=".deb") as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file_path = tmp_file.name
-        subprocess.run(["dpkg-deb", "-x", tmp_file_path, "/tmp/package"])
-        for root, _, files in os.walk("/tmp/package"):
-            for file in files:
-                file_path = os.path.join(root, file)
-                with open(file_path, "r", errors="ignore") as f:
-                    file_content = f.read()
-                    matches.extend(
-                        self.scan_file(file_content, f"{package_name}/{file_path}")
+        while True:
+            header = stream.read(110)
+            if len(header) < 110 or header[:6] not in (b"070701", b"070702"):
+                raise ValueError(f"Unsupported cpio archive in {package_name}")
+            # Fields are 8 hex digits each, after the 6 byte magic
+            mode, file_size, name_size = (
+                int(header[6 + 8 * field : 14 + 8 * field], 16) for field in (1, 6, 11)
+            )
+            name = stream.read(name_size)[:-1].decode("utf-8", errors="replace")
+            # The name and the data are each padded to a multiple of 4 bytes
+            stream.read(-(110 + name_size) % 4)
+            if name == "TRAILER!!!":
+                return matches
+            file_content = stream.read(file_size)
+            stream.read(-file_size % 4)
+            if stat.S_ISREG(mode):
+                matches.extend(
+                    self.scan_file(
+                        file_content, f"{package_name}/{name.removeprefix('./')}"
                     )
-        os.remove(tmp_file_path)
-        return matches
+                )
 
-    def scan_rpm(self, file_content, package_name):
-        """Scan the contents of an .rpm package for leaked strings."""
+    def scan_archive_entries(self, archive, package_name):
+        """Scan the files of an archive opened with libarchive."""
         matches = []
-        with NamedTemporaryFile(delete=False, suffix=".rpm") as tmp_file:
-            tmp_file.write(file_content)
-            tmp_file_path = tmp_file.name
-        subprocess.run(["rpm2cpio", tmp_file_path], stdout=subprocess.PIPE)
-        subprocess.run(["cpio", "-idmv"], stdin=subprocess.PIPE, cwd="/tmp/package")
-        for root, _, files in os.walk("/tmp/package"):
-            for file in files:
-                file_path = os.path.join(root, file)
-                with open(file_path, "r", errors="ignore") as f:
-                    file_content = f.read()
-                    matches.extend(
-                        self.scan_file(file_content, f"{package_name}/{file_path}")
+        for entry in archive:
+            if entry.isfile:
+                matches.extend(
+                    self.scan_stream(
+                        BlockStream(entry.get_blocks()),
+                        f"{package_name}/{entry.pathname.removeprefix('./')}",
                     )
-        os.remove(tmp_file_path)
+                )
         return matches
 
-    def scan_s3_bucket(self):
-        """Scan all files in an S3 bucket with the specified prefix for leaked strings."""
+    def scan_deb(self, fileobj, package_name):
+        """Scan the contents of a .deb package for leaked strings."""
+        if libarchive is not None:
+            # A .deb is an ar archive, and like dpkg-deb -x only the files in
+            # its data.tar member are scanned, read without extracting them
+            with libarchive.stream_reader(fileobj) as archive:
+                for entry in archive:
+                    if entry.pathname.startswith("data.tar"):
+                        with libarchive.stream_reader(
+                            BlockStream(entry.get_blocks())
+                        ) as data:
+                            return self.scan_archive_entries(data, package_name)
+            return []
+
+        # The temporary package is removed on close, even if the scan fails
+        with NamedTemporaryFile(suffix=".deb") as tmp_file:
+            shutil.copyfileobj(fileobj, tmp_file)
+            tmp_file.flush()
+            # Read the files from the tar stream of the package instead of
+            # extracting them to disk
+            dpkg_deb = subprocess.Popen(
+                ["dpkg-deb", "--fsys-tarfile", tmp_file.name], stdout=subprocess.PIPE
+            )
+            with dpkg_deb, tarfile.open(fileobj=dpkg_deb.stdout, mode="r|") as tar:
+                matches = self.scan_tar_stream(tar, package_name)
+        check_returncode(dpkg_deb)
+        return matches
+
+    def scan_rpm(self, fileobj, package_name):
+        """Scan the contents of an .rpm package for leaked strings."""
+        if libarchive is not None:
+            # libarchive reads the cpio payload of the package directly
+            with libarchive.stream_reader(fileobj) as archive:
+                return self.scan_archive_entries(archive, package_name)
+
+        with NamedTemporaryFile(suffix=".rpm") as tmp_file:
+            shutil.copyfileobj(fileobj, tmp_file)
+            tmp_file.flush()
+            # Read the files from the cpio payload as rpm2cpio outputs it
+            rpm2cpio = subprocess.Popen(
+                ["rpm2cpio", tmp_file.name], stdout=subprocess.PIPE
+            )
+            with rpm2cpio:
+                matches = self.scan_cpio_stream(rpm2cpio.stdout, package_name)
+        check_returncode(rpm2cpio)
+        return matches
+
+    def list_s3_keys(self):
+        """List the keys in the S3 bucket with the specified prefix."""
+        s3 = get_s3_client(self.jobs)
         while True:
             if self.continuation_token:
                 response = s3.list_objects_v2(
@@ -255,27 +611,53 @@ class LeakScanner:
                 )
 
             for obj in response.get("Contents", []):
-                key = obj["Key"]
-                print(f"Scanning {key}...")
-                file_obj = s3.get_object(Bucket=self.bucket_name, Key=key)
-                file_content = file_obj["Body"].read()
-
-                for extension, scan_function in self.extension_to_scan_function.items():
-                    if key.endswith(extension):
-                        self.matches.extend(scan_function(file_content, key))
-                        break
-                else:
-                    file_content = file_content.decode("utf-8", errors="ignore")
-                    self.matches.extend(self.scan_file(file_content, key))
+                yield obj["Key"]
 
             if response.get("IsTruncated"):
                 self.continuation_token = response.get("NextContinuationToken")
             else:
                 break
 
+    def scan_s3_object(self, key):
+        """Scan a single S3 object for leaked strings."""
+        # Write the line at once, so that lines from parallel scans do not mix
+        print(f"Scanning {key}...\n", end="")
+        file_obj = get_s3_client(self.jobs).get_object(Bucket=self.bucket_name, Key=key)
+
+        # Archives are read straight from the response stream. Close it when
+        # done, even if the scan stops early, so that its connection is
+        # released to the pool shared by the parallel scans
+        with contextlib.closing(file_obj["Body"]) as body:
+            scan_function = self.get_scan_function(key)
+            if scan_function:
+                return scan_function(body, key)
+            return self.scan_stream(body, key)
+
+    def scan_s3_bucket(self):
+        """Scan all files in an S3 bucket with the specified prefix for leaked strings."""
+        # Downloads wait on the network and decompression releases the GIL,
+        # so scan several objects at once, keeping the results in key order.
+        # Keys are listed as the scans progress instead of all up front
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for matches in map_bounded(
+                executor, self.scan_s3_object, self.list_s3_keys(), 2 * self.jobs
+            ):
+                self.matches.extend(matches)
+
         return self.matches
 
 
+def positive_int(value):
+    """Parse a command line argument as a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value!r}")
+    return number
+
+
 def parse_args():
     def common_args(parser):
         """Add common arguments to the parser."""
@@ -290,6 +672,17 @@ def parse_args():
             default=None,
             help="Regular expression pattern to match sensitive strings",
         )
+        parser.add_argument(
+            "--jobs",
+            type=positive_int,
+            default=8,
+            help="Number of files to scan in parallel (default: 8)",
+        )
+        parser.add_argument(
+            "--skip-binary",
+            action="store_true",
+            help="Skip files that look binary, with less than 30%% printable bytes in the first 4 KiB",
+        )
 
     parser = argparse.ArgumentParser(
         description="Scan for leaked strings in S3 buckets or local files and directories."
@@ -330,6 +723,8 @@ if __name__ == "__main__":
             prefix=args.prefix,
             env_secrets_only=args.env_secrets_only,
             pattern=args.pattern,
+            jobs=args.jobs,
+            skip_binary=args.skip_binary,
         )
         scanner.scan_env_vars()
         matches = scanner.scan_s3_bucket()
@@ -339,6 +734,8 @@ if __name__ == "__main__":
         scanner = LeakScanner(
             env_secrets_only=args.env_secrets_only,
             pattern=args.pattern,
+            jobs=args.jobs,
+            skip_binary=args.skip_binary,
         )
         scanner.scan_env_vars()
         matches = scanner.scan_paths(args.paths)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for rebase.py, run with `python -m unittest test_rebase` or
+`python -m pytest` from the scripts directory.
+"""
+
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+import rebase
+
+
+def file_patch(path, body=b"@@ -1 +1 @@\n-a\n+b\n"):
+    """Build the patch of a single file modification."""
+    return (
+        f"diff --git a/{path} b/{path}\n".encode()
+        + b"index 7898192..6178079 100644\n"
+        + f"--- a/{path}\n+++ b/{path}\n".encode()
+        + body
+    )
+
+
+class SplitPatchByFileTest(unittest.TestCase):
+    """Patches are named by the paths in their own headers."""
+
+    def test_files(self):
+        patch = file_patch("ci/run.sh") + file_patch("docker/with space.txt")
+        self.assertEqual(
+            rebase.split_patch_by_file(patch),
+            {
+                "ci/run.sh": [file_patch("ci/run.sh")],
+                "docker/with space.txt": [file_patch("docker/with space.txt")],
+            },
+        )
+
+    def test_quoted_paths(self):
+        segment = (
+            b'diff --git "a/docker/\\303\\251 \\"q\\".txt" "b/docker/\\303\\251 \\"q\\".txt"\n'
+            b"new file mode 100644\n"
+        )
+        self.assertEqual(
+            rebase.split_patch_by_file(segment),
+            {'docker/é "q".txt': [segment]},
+        )
+
+    def test_submodule_and_type_change(self):
+        submodule = (
+            b"diff --git a/contrib/sub b/contrib/sub\n"
+            b"index d4b13cd..043c8bb 160000\n"
+            b"--- a/contrib/sub\n+++ b/contrib/sub\n"
+            b"@@ -1 +1 @@\n-Subproject commit d4b13cd\n+Subproject commit 043c8bb\n"
+        )
+        # A type change is shown as a deletion and a creation of the same file
+        deleted = b"diff --git a/ci/link b/ci/link\ndeleted file mode 120000\n"
+        created = b"diff --git a/ci/link b/ci/link\nnew file mode 100644\n"
+        patch = submodule + deleted + created + file_patch("docker/d.txt")
+        self.assertEqual(
+            rebase.split_patch_by_file(patch),
+            {
+                "contrib/sub": [submodule],
+                "ci/link": [deleted, created],
+                "docker/d.txt": [file_patch("docker/d.txt")],
+            },
+        )
+
+    def test_no_changes(self):
+        self.assertEqual(rebase.split_patch_by_file(b""), {})
+
+    def test_unexpected_header(self):
+        with self.assertRaises(ValueError):
+            rebase.split_patch_by_file(b"diff --git a/one b/other\n")
+
+
+@unittest.skipIf(shutil.which("git") is None, "git not installed")
+class GeneratePerFileDiffsTest(unittest.TestCase):
+    """Per-file patches are generated for the right files from a real repository."""
+
+    def git(self, *args):
+        subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+            + list(args),
+            cwd=self.work_dir,
+            check=True,
+            capture_output=True,
+        )
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.git("init", "-q")
+        # Summarized submodule changes have no patch header of their own
+        self.git("config", "diff.submodule", "log")
+        self.git("config", "diff.noprefix", "true")
+
+    def commit_files(self, files, submodule_commit):
+        for path, content in files.items():
+            (self.work_dir / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.work_dir / path).write_text(content)
+        self.git("add", "-A")
+        self.git(
+            "update-index",
+            "--add",
+            "--cacheinfo",
+            f"160000,{submodule_commit},contrib/sub",
+        )
+        self.git("commit", "-q", "-m", "commit")
+
+    def test_submodule(self):
+        self.commit_files({"ci/a.sh": "a\n", "docker/d.txt": "a\n"}, "1" * 40)
+        self.git("tag", "base")
+        self.commit_files({"ci/a.sh": "b\n", "docker/d.txt": "b\n"}, "2" * 40)
+
+        diff_dir = self.work_dir / "diffs"
+        generator = rebase.DiffGenerator(self.work_dir, diff_dir)
+        generator.generate_per_file_diffs("refs/tags/base", "HEAD")
+        self.assertEqual(
+            generator.patch_to_file,
+            {
+                "custom_ci_a.sh.patch": "ci/a.sh",
+                "custom_contrib_sub.patch": "contrib/sub",
+                "custom_docker_d.txt.patch": "docker/d.txt",
+            },
+        )
+        for patch_name, path in generator.patch_to_file.items():
+            header = (diff_dir / patch_name).read_text().split("\n", 1)[0]
+            self.assertEqual(header, f"diff --git a/{path} b/{path}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tests for scan_artifacts.py, run with `python -m unittest test_scan_artifacts`
+or `python -m pytest` from the scripts directory.
+"""
+
+import io
+import os
+import unittest
+from unittest import mock
+
+import scan_artifacts
+
+
+class SensitiveStringsTest(unittest.TestCase):
+    """Values of secret environment variables are found wherever they appear."""
+
+    ENVIRONMENT = {
+        # The second value overlaps the end of the first one, and the third
+        # one is contained in the first one
+        "A_PASSWORD": "abcdef",
+        "B_PASSWORD": "defgh",
+        "C_PASSWORD": "bcd",
+    }
+
+    def scan(self, content):
+        with mock.patch.dict(os.environ, self.ENVIRONMENT, clear=True):
+            scanner = scan_artifacts.LeakScanner(env_secrets_only=True)
+            scanner.scan_env_vars()
+        return scanner.scan_file(content, "file.txt")
+
+    def check_overlapping_values(self):
+        self.assertEqual(
+            self.scan(b"first line\nx abcdefgh y\n"),
+            [
+                ("file.txt", 2, "abcd..."),
+                ("file.txt", 2, "bcd..."),
+                ("file.txt", 2, "defg..."),
+            ],
+        )
+
+    def check_repeated_values(self):
+        # Each value is reported once per line it appears on
+        self.assertEqual(
+            self.scan(b"abcdef abcdef\nno secret\nabcdef\n"),
+            [
+                ("file.txt", 1, "abcd..."),
+                ("file.txt", 1, "bcd..."),
+                ("file.txt", 3, "abcd..."),
+                ("file.txt", 3, "bcd..."),
+            ],
+        )
+
+    def check_large_input(self):
+        # Values at the edges of the chunks that large buffers are searched in
+        chunk_size = scan_artifacts.CHUNK_SIZE
+        content = bytearray((b"." * 99 + b"\n") * (chunk_size * 3 // 100))
+        content[chunk_size - 3 : chunk_size + 5] = b"abcdefgh"
+        content[2 * chunk_size : 2 * chunk_size + 6] = b"abcdef"
+        first_line = content.count(b"\n", 0, chunk_size) + 1
+        second_line = content.count(b"\n", 0, 2 * chunk_size) + 1
+        self.assertEqual(
+            self.scan(bytes(content)),
+            [
+                ("file.txt", first_line, "abcd..."),
+                ("file.txt", first_line, "bcd..."),
+                ("file.txt", first_line, "defg..."),
+                ("file.txt", second_line, "abcd..."),
+                ("file.txt", second_line, "bcd..."),
+            ],
+        )
+
+    def test_patterns(self):
+        with mock.patch.object(scan_artifacts, "ahocorasick", None):
+            self.check_overlapping_values()
+            self.check_repeated_values()
+            self.check_large_input()
+
+    @unittest.skipIf(scan_artifacts.ahocorasick is None, "pyahocorasick not installed")
+    def test_automaton(self):
+        self.check_overlapping_values()
+        self.check_repeated_values()
+        self.check_large_input()
+
+
+class LongLineTest(unittest.TestCase):
+    """Lines longer than MAX_LINE_SIZE are scanned in windows without losing matches."""
+
+    def setUp(self):
+        # Small sizes, so that a short line is scanned in several windows
+        for name, value in (
+            ("CHUNK_SIZE", 16),
+            ("MAX_LINE_SIZE", 64),
+            ("LINE_OVERLAP", 8),
+        ):
+            patcher = mock.patch.object(scan_artifacts, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch.dict(os.environ, {"A_TOKEN": "hunter2xyz"}, clear=True):
+            self.scanner = scan_artifacts.LeakScanner()
+            self.scanner.scan_env_vars()
+
+    def scan(self, content):
+        return self.scanner.scan_stream(io.BytesIO(content), "f")
+
+    def test_match_across_window_edge(self):
+        # The first window is cut 8 bytes before its end of 80 bytes, inside
+        # the pattern match and the value
+        for start in range(64, 76):
+            with self.subTest(start=start):
+                content = b"x" * start + b"ABTOKEN" + b"x" * 200 + b"\nB_TOKEN\n"
+                self.assertEqual(
+                    self.scan(content), [("f", 1, "ABTOKEN"), ("f", 2, "B_TOKEN")]
+                )
+                content = b"x" * start + b"hunter2xyz" + b"x" * 200 + b"\n"
+                self.assertEqual(self.scan(content), [("f", 1, "hunt...")])
+
+    def test_values_reported_once_per_line(self):
+        content = b"hunter2xyz" + b"x" * 300 + b"hunter2xyz" + b"x" * 300 + b"\n"
+        self.assertEqual(self.scan(content), [("f", 1, "hunt...")])
+
+
+def cpio_entry(name, data=b"", mode=0o100644):
+    """Build an entry of a new ASCII (newc) cpio archive."""
+    name = name.encode() + b"\0"
+    fields = [0, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+    header = b"070701" + b"".join(b"%08X" % field for field in fields)
+    # The name and the data are each padded to a multiple of 4 bytes
+    return (
+        header
+        + name
+        + b"\0" * (-(len(header) + len(name)) % 4)
+        + data
+        + b"\0" * (-len(data) % 4)
+    )
+
+
+class CpioStreamTest(unittest.TestCase):
+    """Files in cpio archives are read from their headers and padding."""
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"A_TOKEN": "hunter2xyz"}, clear=True):
+            self.scanner = scan_artifacts.LeakScanner()
+            self.scanner.scan_env_vars()
+
+    def scan(self, archive):
+        return self.scanner.scan_cpio_stream(io.BytesIO(archive), "p.rpm")
+
+    def test_entries(self):
+        archive = (
+            cpio_entry(".", mode=0o040755)
+            # Names of every length modulo 4, so that each padding is used
+            + cpio_entry("./a", b"one\nA_TOKEN=hunter2xyz\n")
+            + cpio_entry("./empty")
+            + cpio_entry("./etc", mode=0o040755)
+            + cpio_entry("./etc/b.conf", b"B_SECRET\n")
+            + cpio_entry("./link", b"a", mode=0o120777)
+            + cpio_entry("./etc/cc", b"x\ny\nhunter2xyz")
+            + cpio_entry("TRAILER!!!")
+        )
+        self.assertEqual(
+            self.scan(archive),
+            [
+                ("p.rpm/a", 2, "A_TOKEN"),
+                ("p.rpm/a", 2, "hunt..."),
+                ("p.rpm/etc/b.conf", 1, "B_SECRET"),
+                ("p.rpm/etc/cc", 3, "hunt..."),
+            ],
+        )
+
+    def test_empty_archive(self):
+        self.assertEqual(self.scan(cpio_entry("TRAILER!!!")), [])
+
+    def test_unsupported_archive(self):
+        for archive in (b"", b"070707" + b"0" * 104, cpio_entry("./a", b"A_TOKEN")):
+            with self.subTest(archive=archive[:6]):
+                # The last archive is cut off before its trailer
+                with self.assertRaises(ValueError):
+                    self.scan(archive)
+
+
+if __name__ == "__main__":
+    unittest.main()